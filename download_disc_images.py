@@ -2,31 +2,60 @@
 """
 Download disc images from weblinks and store in SQLite database.
 - Extracts image URL from webpage using selector: a.img-holder img.img-fluid
-- Converts webp to png for DB Browser compatibility
-- Stores image as BLOB in 'img' column
-- Also saves to ./images/ folder as backup
+- Converts to webp at source resolution (webp sources stored as-is)
+- Saves images to ./images/ and stores the relative path in 'img_path'
+- Caches the scraped image URL in 'img_url' so reruns skip the page fetch
 """
 
 import sqlite3
 import os
 import re
 import io
+import html
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from urllib.parse import urlparse
 from pathlib import Path
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image
+# Register only the plugins we decode, so Image.open never falls back to
+# importing every format plugin via Image.init()
+from PIL import GifImagePlugin, JpegImagePlugin, PngImagePlugin, WebPImagePlugin  # noqa: F401
 
 # Configuration
 DB_PATH = "disc_flight_data.db"
 IMAGES_DIR = Path("./images")
-MAX_WORKERS = 10
+MAX_WORKERS = 32  # network-bound; threads mostly wait on sockets
 REQUEST_TIMEOUT = 30
+CHUNK_SIZE = 16 * 1024
+MATCH_OVERLAP = 16 * 1024  # longest a.img-holder ... img.img-fluid span expected on a page
+MAX_PAGE_BYTES = 5_000_000
+MAX_IMG_BYTES = 10_000_000
+DB_BATCH_SIZE = 32
+IMAGE_FORMATS = ("JPEG", "PNG", "WEBP", "GIF")
+IMG_MAX_SIZE = None  # e.g. (512, 512) to downscale; None keeps source resolution
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 
+# Equivalent of the CSS selector "a.img-holder img.img-fluid", run directly
+# over the raw page bytes instead of building a full parse tree
+IMG_TAG_RE = re.compile(
+    rb'<a\b[^>]*(?<![\w-])class=["\'][^"\']*(?<![\w-])img-holder(?![\w-])[^"\']*["\'][^>]*>'
+    rb'(?:(?!</a>).)*?'
+    rb'(<img\b[^>]*(?<![\w-])class=["\'][^"\']*(?<![\w-])img-fluid(?![\w-])[^"\']*["\'][^>]*>)',
+    re.S | re.I,
+)
+IMG_SRC_RE = re.compile(rb'(?<![\w-])src=["\']([^"\']+)["\']', re.I)
+
+# Filename sanitizing
+FILENAME_TRANS = str.maketrans({c: '_' for c in '<>:"/\\|?*'})
+WHITESPACE_RE = re.compile(r'\s+')
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -35,42 +64,75 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Shared HTTP session so pages and images reuse pooled keep-alive connections
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": USER_AGENT})
+_adapter = HTTPAdapter(
+    pool_connections=MAX_WORKERS,
+    pool_maxsize=MAX_WORKERS * 2,
+    max_retries=Retry(total=3, backoff_factor=0.3),
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+# One long-lived SQLite connection per thread (see get_connection)
+_db_local = threading.local()
 
-def ensure_img_column(db_path: str) -> None:
-    """Add 'img' BLOB column if it doesn't exist."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+
+def get_connection(db_path: str) -> sqlite3.Connection:
+    """
+    Return this thread's connection, opening it on first use.
+    Autocommit mode with WAL, so the main thread can read while the writer
+    thread commits. Repeated statements hit sqlite3's per-connection statement cache.
+    """
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA wal_autocheckpoint=10000")
+        _db_local.conn = conn
+    return conn
+
+
+def close_connection() -> None:
+    """Close this thread's connection, if one was opened."""
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _db_local.conn = None
+
+
+def ensure_img_columns(db_path: str) -> None:
+    """Add 'img_path' and 'img_url' TEXT columns if they don't exist."""
+    cursor = get_connection(db_path).cursor()
     
-    # Check if column exists
+    # Check which columns exist
     cursor.execute("PRAGMA table_info(disc_data)")
     columns = [row[1] for row in cursor.fetchall()]
     
-    if "img" not in columns:
-        logger.info("Adding 'img' column to disc_data table")
-        cursor.execute("ALTER TABLE disc_data ADD COLUMN img BLOB")
-        conn.commit()
-    else:
-        logger.info("'img' column already exists")
-    
-    conn.close()
+    for name, col_type in (("img_path", "TEXT"), ("img_url", "TEXT")):
+        if name not in columns:
+            logger.info(f"Adding '{name}' column to disc_data table")
+            cursor.execute(f"ALTER TABLE disc_data ADD COLUMN {name} {col_type}")
+        else:
+            logger.info(f"'{name}' column already exists")
 
 
 def get_discs_to_process(db_path: str) -> list[dict]:
-    """Fetch discs that need image download (have weblink, no img)."""
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    """Fetch discs that need image download (have weblink, no img_path)."""
+    cursor = get_connection(db_path).cursor()
+    cursor.row_factory = sqlite3.Row
     
     cursor.execute("""
-        SELECT id, model, manufacturer, weblink 
+        SELECT id, model, manufacturer, weblink, img_url 
         FROM disc_data 
         WHERE weblink IS NOT NULL 
           AND weblink != '' 
-          AND (img IS NULL OR img = '')
+          AND (img_path IS NULL OR img_path = '')
     """)
     
     discs = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     
     logger.info(f"Found {len(discs)} discs to process")
     return discs
@@ -81,19 +143,26 @@ def extract_image_url(weblink: str) -> str | None:
     Visit webpage and extract image URL from:
     a.img-holder img.img-fluid
     """
-    headers = {"User-Agent": USER_AGENT}
-    
     try:
-        response = requests.get(weblink, headers=headers, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, "html.parser")
+        # Stream the page and stop reading as soon as the image tag shows up
+        page = bytearray()
+        match = None
+        with SESSION.get(weblink, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                page += chunk
+                # Find a.img-holder > img.img-fluid. Only rescan the new chunk plus
+                # enough earlier bytes for a match that started before it, rather
+                # than the whole growing buffer
+                scan_from = max(0, len(page) - len(chunk) - MATCH_OVERLAP)
+                match = IMG_TAG_RE.search(page, scan_from)
+                if match or len(page) > MAX_PAGE_BYTES:
+                    break
         
-        # Find a.img-holder > img.img-fluid
-        img_holder = soup.select_one("a.img-holder img.img-fluid")
+        src = IMG_SRC_RE.search(match.group(1)) if match else None
         
-        if img_holder and img_holder.get("src"):
-            img_url = img_holder["src"]
+        if src:
+            img_url = html.unescape(src.group(1).decode("utf-8", "replace"))
             # Handle relative URLs
             if img_url.startswith("//"):
                 img_url = "https:" + img_url
@@ -109,128 +178,271 @@ def extract_image_url(weblink: str) -> str | None:
         return None
 
 
-def download_and_convert_image(img_url: str) -> bytes | None:
-    """Download image and convert to PNG bytes."""
-    headers = {"User-Agent": USER_AGENT}
-    
+def download_image(img_url: str) -> bytes | None:
+    """Download raw image bytes."""
     try:
-        response = requests.get(img_url, headers=headers, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        
-        # Open image and convert to PNG
-        img = Image.open(io.BytesIO(response.content))
+        # Read at most MAX_IMG_BYTES (+1 to detect oversized bodies)
+        with SESSION.get(img_url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            response.raise_for_status()
+            
+            # Bail out on error pages and oversized bodies before reading them
+            content_type = response.headers.get("Content-Type", "")
+            if not content_type.startswith("image/"):
+                logger.warning(f"Not an image ({content_type or 'no content type'}), skipping: {img_url}")
+                return None
+            
+            content_length = response.headers.get("Content-Length")
+            if content_length and content_length.isdigit() and int(content_length) > MAX_IMG_BYTES:
+                logger.warning(f"Image too large ({content_length} bytes), skipping: {img_url}")
+                return None
+            
+            data = response.raw.read(MAX_IMG_BYTES + 1, decode_content=True)
         
-        # Convert to RGB if necessary (for PNG compatibility)
-        if img.mode in ("RGBA", "LA", "P"):
-            # Keep alpha channel for PNG
-            if img.mode == "P":
-                img = img.convert("RGBA")
-        elif img.mode != "RGB":
-            img = img.convert("RGB")
+        if len(data) > MAX_IMG_BYTES:
+            logger.warning(f"Image too large, skipping: {img_url}")
+            return None
         
-        # Save as PNG to bytes
-        png_buffer = io.BytesIO()
-        img.save(png_buffer, format="PNG", optimize=True)
-        return png_buffer.getvalue()
+        return data
         
     except Exception as e:
-        logger.error(f"Failed to download/convert image {img_url}: {e}")
+        logger.error(f"Failed to download image {img_url}: {e}")
         return None
 
 
+def convert_image(data: bytes) -> bytes:
+    """
+    Convert raw image bytes to WebP bytes, downscaling to fit IMG_MAX_SIZE if set.
+    Runs in a worker process, so errors are raised to the caller rather than logged.
+    """
+    img = Image.open(io.BytesIO(data), formats=IMAGE_FORMATS)
+    
+    # Let libjpeg decode at the smallest 1/2, 1/4 or 1/8 scale still covering IMG_MAX_SIZE
+    if IMG_MAX_SIZE and img.format == "JPEG":
+        img.draft("RGB", IMG_MAX_SIZE)
+    
+    # Normalize to a mode WebP can encode, keeping alpha where present
+    if img.mode in ("P", "LA"):
+        img = img.convert("RGBA")
+    elif img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    
+    # Shrink in place, keeping aspect ratio (never upscales)
+    if IMG_MAX_SIZE:
+        img.thumbnail(IMG_MAX_SIZE, Image.Resampling.LANCZOS)
+    
+    # Save as WebP to bytes
+    webp_buffer = io.BytesIO()
+    img.save(webp_buffer, format="WEBP", quality=85, method=4)
+    return webp_buffer.getvalue()
+
+
+def can_store_as_is(data: bytes) -> bool:
+    """
+    Check whether the image is already a WebP (that fits IMG_MAX_SIZE, if set).
+    Image.open only reads the header, so this is cheap enough for the IO threads.
+    """
+    with Image.open(io.BytesIO(data), formats=IMAGE_FORMATS) as img:
+        if img.format != "WEBP":
+            return False
+        return IMG_MAX_SIZE is None or (img.width <= IMG_MAX_SIZE[0] and img.height <= IMG_MAX_SIZE[1])
+
+
 def sanitize_filename(name: str) -> str:
     """Remove/replace invalid filename characters."""
-    # Replace problematic characters
-    sanitized = re.sub(r'[<>:"/\\|?*]', '_', name)
-    sanitized = re.sub(r'\s+', '_', sanitized)
-    return sanitized
+    # Swap problematic characters in one C-level pass, then collapse whitespace
+    return WHITESPACE_RE.sub('_', name.translate(FILENAME_TRANS))
+
+
+def image_filename(disc_id: int, manufacturer: str, model: str, ext: str) -> str:
+    """Build the ./images/ filename for a disc."""
+    # disc_id keeps names unique: some discs share manufacturer + model, and
+    # others differ only by case, which collides on case-insensitive filesystems
+    return f"{disc_id}_{sanitize_filename(manufacturer)}_{sanitize_filename(model)}{ext}"
 
 
-def process_disc(disc: dict) -> tuple[int, bytes | None, str | None]:
+def process_disc(disc: dict, encoder: ProcessPoolExecutor) -> tuple[int, str | None, bytes | None, str | None]:
     """
-    Process a single disc: extract URL, download, convert.
-    Returns: (disc_id, png_bytes, filename)
+    Process a single disc: extract URL (unless cached), download, convert.
+    Conversion is handed to the encoder process pool so it runs on all cores.
+    Returns: (disc_id, img_url, img_bytes, filename)
     """
     disc_id = disc["id"]
     weblink = disc["weblink"]
     manufacturer = disc["manufacturer"]
     model = disc["model"]
     
-    filename = f"{sanitize_filename(manufacturer)}_{sanitize_filename(model)}.png"
+    filename = image_filename(disc_id, manufacturer, model, ".webp")
     
     logger.info(f"Processing: {manufacturer} {model} (ID: {disc_id})")
     
-    # Extract image URL from webpage
-    img_url = extract_image_url(weblink)
-    if not img_url:
-        logger.warning(f"No image URL found for {manufacturer} {model}")
-        return (disc_id, None, None)
+    # Use the image URL cached by a previous run, else extract it from the webpage
+    img_url = disc["img_url"]
+    raw_bytes = download_image(img_url) if img_url else None
     
-    # Download and convert to PNG
-    png_bytes = download_and_convert_image(img_url)
-    if not png_bytes:
-        return (disc_id, None, None)
+    if not raw_bytes:
+        # Nothing cached, or the cached URL has gone stale
+        scraped_url = extract_image_url(weblink)
+        if not scraped_url:
+            logger.warning(f"No image URL found for {manufacturer} {model}")
+            return (disc_id, img_url, None, None)
+        
+        if scraped_url != img_url:
+            img_url = scraped_url
+            raw_bytes = download_image(img_url)
+        if not raw_bytes:
+            return (disc_id, img_url, None, None)
+    
+    # Convert to WebP in a worker process, unless it can be stored as-is
+    # (checked here so those images are never pickled to a worker and back)
+    try:
+        if can_store_as_is(raw_bytes):
+            img_bytes = raw_bytes
+        else:
+            img_bytes = encoder.submit(convert_image, raw_bytes).result()
+    except Exception as e:
+        logger.error(f"Failed to convert image {img_url}: {e}")
+        return (disc_id, img_url, None, None)
     
-    logger.info(f"Successfully processed: {manufacturer} {model} ({len(png_bytes)} bytes)")
-    return (disc_id, png_bytes, filename)
+    logger.info(f"Successfully processed: {manufacturer} {model} ({len(img_bytes)} bytes)")
+    return (disc_id, img_url, img_bytes, filename)
 
 
-def save_to_file(filename: str, data: bytes) -> None:
-    """Save image bytes to file."""
+def save_to_file(filename: str, data: bytes) -> str | None:
+    """
+    Save image bytes to file and return its path, or None on failure.
+    Only called via store_image on the file-writer threads, so errors are logged.
+    """
     filepath = IMAGES_DIR / filename
-    with open(filepath, "wb") as f:
-        f.write(data)
+    try:
+        # Raw fd write skips the buffered file-object layer and its copy
+        fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        return str(filepath)
+    except Exception as e:
+        logger.error(f"Failed to save {filepath}: {e}")
+        return None
+
+
+def store_image(disc_id: int, img_url: str, filename: str, data: bytes, updates: queue.Queue) -> bool:
+    """Write the image file, then queue its path for the database writer. Returns success."""
+    img_path = save_to_file(filename, data)
+    updates.put((img_url, img_path, disc_id))
+    return img_path is not None
 
 
-def update_db_image(db_path: str, disc_id: int, img_data: bytes) -> None:
-    """Update single disc's img column."""
-    conn = sqlite3.connect(db_path)
+def db_writer(db_path: str, updates: queue.Queue) -> None:
+    """
+    Drain (img_url, img_path, disc_id) tuples from the queue and write them in batches.
+    A None img_path keeps the cached URL without touching the stored path.
+    Runs on its own thread with its own connection; None signals shutdown.
+    """
+    conn = get_connection(db_path)
     cursor = conn.cursor()
-    cursor.execute("UPDATE disc_data SET img = ? WHERE id = ?", (img_data, disc_id))
-    conn.commit()
-    conn.close()
+    
+    done = False
+    while not done:
+        # Block for the first item, then take whatever else is already queued
+        batch = []
+        item = updates.get()
+        while True:
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+            if len(batch) >= DB_BATCH_SIZE:
+                break
+            try:
+                item = updates.get_nowait()
+            except queue.Empty:
+                break
+        
+        if not batch:
+            continue
+        
+        try:
+            cursor.execute("BEGIN")
+            cursor.executemany(
+                "UPDATE disc_data SET img_url = ?, img_path = COALESCE(?, img_path) WHERE id = ?",
+                batch,
+            )
+            cursor.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Failed to write {len(batch)} image paths to database: {e}")
+            if conn.in_transaction:
+                cursor.execute("ROLLBACK")
+    
+    close_connection()
 
 
 def main():
     # Ensure images directory exists
     IMAGES_DIR.mkdir(exist_ok=True)
     
-    # Ensure img column exists
-    ensure_img_column(DB_PATH)
+    # Ensure img_path/img_url columns exist
+    ensure_img_columns(DB_PATH)
     
     # Get discs to process
     discs = get_discs_to_process(DB_PATH)
     
     if not discs:
         logger.info("No discs to process")
+        close_connection()
         return
     
     success_count = 0
     fail_count = 0
     
-    # Process concurrently
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        future_to_disc = {executor.submit(process_disc, disc): disc for disc in discs}
+    # Single writer thread batches all DB updates
+    updates = queue.Queue()
+    writer = threading.Thread(target=db_writer, args=(DB_PATH, updates), daemon=True)
+    writer.start()
+    
+    # Process concurrently. Encoder workers are spawned rather than forked:
+    # they start on the first submit, from inside an already running IO thread
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn")) as encoder, \
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, \
+            ThreadPoolExecutor(max_workers=2) as file_executor:
+        store_futures = []
+        future_to_disc = {executor.submit(process_disc, disc, encoder): disc for disc in discs}
         
         for future in as_completed(future_to_disc):
             disc = future_to_disc[future]
             try:
-                disc_id, png_bytes, filename = future.result()
+                disc_id, img_url, img_bytes, filename = future.result()
                 
-                if png_bytes and filename:
-                    # Save to database
-                    update_db_image(DB_PATH, disc_id, png_bytes)
-                    
-                    # Save to file as backup
-                    save_to_file(filename, png_bytes)
-                    
-                    success_count += 1
+                # Cache the discovered URL even if the download failed
+                if img_url and not img_bytes:
+                    updates.put((img_url, None, disc_id))
+                
+                if img_bytes and filename:
+                    # Save to file off the dispatch loop; the path is queued
+                    # for the database writer once the file exists
+                    store_futures.append(
+                        file_executor.submit(store_image, disc_id, img_url, filename, img_bytes, updates)
+                    )
                 else:
                     fail_count += 1
                     
             except Exception as e:
                 logger.error(f"Error processing disc {disc['id']}: {e}")
                 fail_count += 1
+        
+        # A disc only counts as a success once its file has been written
+        for future in store_futures:
+            if future.result():
+                success_count += 1
+            else:
+                fail_count += 1
+    
+    # Flush remaining updates and wait for the writer to finish
+    updates.put(None)
+    writer.join()
+    close_connection()
     
     logger.info(f"Completed: {success_count} success, {fail_count} failed")
 
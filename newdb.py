@@ -17,6 +17,14 @@ def create_database(db_path: str) -> sqlite3.Connection:
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
+    # Bulk-load settings: main() rebuilds the database from scratch, so a crash
+    # mid-load is recovered by simply re-running the script
+    cursor.execute('PRAGMA journal_mode=OFF')
+    cursor.execute('PRAGMA synchronous=OFF')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA cache_size=-65536')  # 64 MB
+    cursor.execute('PRAGMA locking_mode=EXCLUSIVE')
+    
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS discs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -41,8 +49,7 @@ def create_database(db_path: str) -> sqlite3.Connection:
             bh3 TEXT,
             fh1 TEXT,
             fh2 TEXT,
-            fh3 TEXT,
-            UNIQUE(manufacturer, disc_model)
+            fh3 TEXT
         )
     ''')
     
@@ -70,70 +77,118 @@ def parse_int(value: str) -> int | None:
         return None
 
 
+def iter_rows(reader, counts: dict[str, int]):
+    """
+    Yield insert tuples from a csv.reader, skipping blank and truncated rows and
+    duplicate (manufacturer, disc_model) pairs. Tallies 'inserted' and
+    'skipped' rows in counts.
+    """
+    # Resolve header positions once instead of a dict lookup per field per row
+    header = next(reader, None)
+    if header is None:
+        return
+    idx = {name: i for i, name in enumerate(header)}
+    mfg_i = idx['Manufacturer / Distributor']
+    model_i = idx['Disc Model']
+    max_weight_i = idx['Max Weight (gr)']
+    diameter_i = idx['Diameter (cm)']
+    height_i = idx['Height (cm)']
+    rim_depth_i = idx['Rim Depth (cm)']
+    inside_rim_i = idx['Inside Rim Diameter (cm)']
+    rim_thickness_i = idx['Rim Thickness (cm)']
+    rim_ratio_i = idx['Rim Depth / Diameter Ratio (%)']
+    rim_config_i = idx['Rim Configuration']
+    flexibility_i = idx['Flexibility (kg)']
+    class_i = idx['Class']
+    max_weight_vint_i = idx['Max Weight Vint (gr)']
+    last_year_i = idx['Last Year Production']
+    cert_i = idx['Certification Number']
+    approved_i = idx['Approved Date']
+    
+    seen = set()
+    for row in reader:
+        # Blank lines are skipped silently, as DictReader did
+        if not row:
+            continue
+        if len(row) < len(header):
+            model = row[model_i].strip() if model_i < len(row) else ''
+            print(f"Error inserting row: {model or 'Unknown'} - expected {len(header)} fields, got {len(row)}")
+            counts['skipped'] += 1
+            continue
+        
+        # Duplicates are dropped here, since the unique index is only built
+        # once the load has finished
+        key = (row[mfg_i].strip(), row[model_i].strip())
+        if key in seen:
+            counts['skipped'] += 1
+            continue
+        seen.add(key)
+        counts['inserted'] += 1
+        
+        yield (
+            key[0],
+            key[1],
+            parse_float(row[max_weight_i]),
+            parse_float(row[diameter_i]),
+            parse_float(row[height_i]),
+            parse_float(row[rim_depth_i]),
+            parse_float(row[inside_rim_i]),
+            parse_float(row[rim_thickness_i]),
+            parse_float(row[rim_ratio_i]),
+            parse_float(row[rim_config_i]),
+            parse_float(row[flexibility_i]),
+            row[class_i].strip() or None,
+            parse_float(row[max_weight_vint_i]),
+            parse_int(row[last_year_i]),
+            row[cert_i].strip() or None,
+            row[approved_i].strip() or None,
+            None, None, None,  # bh1, bh2, bh3
+            None, None, None   # fh1, fh2, fh3
+        )
+
+
 def load_csv_to_db(csv_path: str, conn: sqlite3.Connection) -> int:
     """Load CSV data into database. Returns number of rows inserted."""
     cursor = conn.cursor()
-    rows_inserted = 0
-    rows_skipped = 0
+    counts = {'inserted': 0, 'skipped': 0}
     
     with open(csv_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
         
-        for row in reader:
-            try:
-                cursor.execute('''
-                    INSERT OR IGNORE INTO discs (
-                        manufacturer,
-                        disc_model,
-                        max_weight,
-                        diameter,
-                        height,
-                        rim_depth,
-                        inside_rim_diameter,
-                        rim_thickness,
-                        rim_depth_diameter_ratio,
-                        rim_configuration,
-                        flexibility,
-                        class,
-                        max_weight_vint,
-                        last_year_production,
-                        certification_number,
-                        approved_date,
-                        bh1, bh2, bh3,
-                        fh1, fh2, fh3
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    row.get('Manufacturer / Distributor', '').strip(),
-                    row.get('Disc Model', '').strip(),
-                    parse_float(row.get('Max Weight (gr)', '')),
-                    parse_float(row.get('Diameter (cm)', '')),
-                    parse_float(row.get('Height (cm)', '')),
-                    parse_float(row.get('Rim Depth (cm)', '')),
-                    parse_float(row.get('Inside Rim Diameter (cm)', '')),
-                    parse_float(row.get('Rim Thickness (cm)', '')),
-                    parse_float(row.get('Rim Depth / Diameter Ratio (%)', '')),
-                    parse_float(row.get('Rim Configuration', '')),
-                    parse_float(row.get('Flexibility (kg)', '')),
-                    row.get('Class', '').strip() or None,
-                    parse_float(row.get('Max Weight Vint (gr)', '')),
-                    parse_int(row.get('Last Year Production', '')),
-                    row.get('Certification Number', '').strip() or None,
-                    row.get('Approved Date', '').strip() or None,
-                    None, None, None,  # bh1, bh2, bh3
-                    None, None, None   # fh1, fh2, fh3
-                ))
-                
-                if cursor.rowcount > 0:
-                    rows_inserted += 1
-                else:
-                    rows_skipped += 1
-                    
-            except Exception as e:
-                print(f"Error inserting row: {row.get('Disc Model', 'Unknown')} - {e}")
-                rows_skipped += 1
+        # One transaction and one prepared statement for the whole load; rows
+        # are streamed from the generator and bound in C by executemany
+        with conn:
+            cursor.executemany('''
+                INSERT INTO discs (
+                    manufacturer,
+                    disc_model,
+                    max_weight,
+                    diameter,
+                    height,
+                    rim_depth,
+                    inside_rim_diameter,
+                    rim_thickness,
+                    rim_depth_diameter_ratio,
+                    rim_configuration,
+                    flexibility,
+                    class,
+                    max_weight_vint,
+                    last_year_production,
+                    certification_number,
+                    approved_date,
+                    bh1, bh2, bh3,
+                    fh1, fh2, fh3
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', iter_rows(reader, counts))
     
+    return counts['inserted'], counts['skipped']
+
+
+def create_indexes(conn: sqlite3.Connection) -> None:
+    """Create indexes after the bulk load so inserts don't maintain them per row."""
+    cursor = conn.cursor()
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_disc ON discs(manufacturer, disc_model)')
     conn.commit()
-    return rows_inserted, rows_skipped
 
 
 def main():
@@ -159,6 +214,7 @@ def main():
     
     print(f"Loading data from: {csv_path}")
     inserted, skipped = load_csv_to_db(str(csv_path), conn)
+    create_indexes(conn)
     
     # Summary
     cursor = conn.cursor()